@@ -10,23 +10,40 @@ import logging
 from argparse import ArgumentParser
 
 from util.gcp import Gcp
+from util.asset_inventory import AssetInventory, AssetInventoryError
+from util.firewall import FirewallIndex
 from util.slack import notify_alerts_security
-from util.generate import generate_message
+from util.generate import generate_message, generate_summary_message
+from util.results import ResultsStore
+from util.planner import plan_scan
 from util.dump_to_gcs import upload_to_bucket
 
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
-# A list to collect all the insecure objects
-LIST_OF_SHAME = []
+# Collects all the insecure objects, see util.results
+LIST_OF_SHAME = ResultsStore()
+
+
+def _shame(record, obj):
+    """adds record to LIST_OF_SHAME under its own project, or the one
+    being scanned"""
+
+    LIST_OF_SHAME.append(record, getattr(record, 'project', '') or obj.project)
 
 def check_firewall_rules(obj):
-    """checks all firewall rules for insecure protocols"""
+    """checks all firewall rules for sensitive ports or all protocols
+    exposed to the internet"""
 
     LOG.info('checking firewall in %r', obj.project)
-    for rule in obj.get_full_firewall_rules():
-        if rule.info['protocol'] == 'all' and '0.0.0.0/0' in rule.info['ranges']:
-            LIST_OF_SHAME.append(rule)
+    index = FirewallIndex(obj.get_full_firewall_rules())
+
+    for rule, shadowed_by in index.shadowed():
+        LOG.info('firewall rule %r is shadowed by %r and never matches',
+                 rule.name, shadowed_by.name)
+
+    for rule in index.exposed_rules():
+        _shame(rule, obj)
 
 
 def check_bucket_acl(obj):
@@ -35,7 +52,7 @@ def check_bucket_acl(obj):
     LOG.info('checking bucket acls in %r', obj.project)
     for acl in obj.get_all_bucket_acl():
         if 'allUsers' in acl.info['entity']:
-            LIST_OF_SHAME.append(acl)
+            _shame(acl, obj)
 
 
 def check_objects_acl(obj):
@@ -44,7 +61,7 @@ def check_objects_acl(obj):
     LOG.info('checking bucket object acls in %r', obj.project)
     for acl in obj.get_all_objects_acls():
         if 'allUsers' in acl.info['entity']:
-            LIST_OF_SHAME.append(acl)
+            _shame(acl, obj)
 
 def argument_parser():
     """Arguments for project and keyfile"""
@@ -55,9 +72,24 @@ def argument_parser():
     parser.add_argument('-k', '--keyfile', help='Specify GCP credentials keyfile')
     parser.add_argument('--whitelist', help="""whitelists one or more buckets.
 Whitelist should be in a yaml format. Please see documentation!""")
+    parser.add_argument('--asset-export', help="""read buckets and firewalls
+from a local Cloud Asset Inventory export (file or directory) instead of
+calling the APIs. Object ACLs are not checked""")
+    parser.add_argument('--results', help="""save violations to this file in a
+compact columnar format for later analysis""")
+    parser.add_argument('--plan', action='store_true', help="""estimate API
+calls, time and memory for the scan and print the plan without running it""")
+    parser.add_argument('--sample', action='store_true', help="""only check a
+random sample of object ACLs in buckets with more than a page of objects""")
+    parser.add_argument('--dump-project', help="""project whose gcp-audit-dumps
+bucket results are uploaded to when there are too many for Slack. Defaults to
+--project, needed for asset exports scanned without one""")
 
     options = parser.parse_args()
 
+    if not (options.dump_project or options.project):
+        parser.error('--project or --dump-project is required')
+
     return options
 
 def main():
@@ -66,9 +98,27 @@ def main():
     options = argument_parser()
 
     LOG.info('Starting to run check')
-    run_check = Gcp(options.project,
-                    options.keyfile,
-                    options.whitelist)
+    if options.asset_export:
+        try:
+            run_check = AssetInventory(options.asset_export,
+                                       options.project,
+                                       options.whitelist)
+        except AssetInventoryError as error:
+            LOG.error('%s', error)
+            raise SystemExit(1)
+    else:
+        run_check = Gcp(options.project,
+                        options.keyfile,
+                        options.whitelist)
+        run_check.plan = plan_scan(run_check, options.sample)
+
+    if options.plan:
+        if run_check.plan:
+            print(run_check.plan.format())
+        else:
+            LOG.info('nothing to plan - asset exports make no API calls')
+        return
+
     checks = [
         check_firewall_rules,
         check_bucket_acl,
@@ -78,18 +128,33 @@ def main():
     for check in checks:
         check(run_check)
 
+    if run_check.plan and run_check.plan.sampled:
+        LOG.warning('object acls were only sampled in %s - other objects '
+                    'there were not checked',
+                    ', '.join(run_check.plan.sampled))
+
+    if options.results:
+        LIST_OF_SHAME.save(options.results)
+        LOG.info('saved %r violations to %s' % (len(LIST_OF_SHAME),
+                                                options.results))
+
     # Getting total number of violations
     length = len(LIST_OF_SHAME)
+    # An export scanned without --project covers every project in it
+    label = options.project or 'all exported projects'
 
     if 0 < length < 15:
-        msg = generate_message(LIST_OF_SHAME, options.project)
+        msg = generate_message(LIST_OF_SHAME, label)
         notify_alerts_security(msg)
         LOG.info('submitted %r checks' % length)
     elif length > 15:
         LOG.info('too many violations - dumping to file')
         upload_to_bucket(records=LIST_OF_SHAME,
                          keyfile=options.keyfile,
-                         project=options.project)
+                         project=options.dump_project or options.project,
+                         label=label)
+        notify_alerts_security(generate_summary_message(LIST_OF_SHAME,
+                                                        label))
     else:
         LOG.info('all clear. No violations found')
 
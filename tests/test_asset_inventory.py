@@ -0,0 +1,145 @@
+# pylint: disable-all
+import json
+
+import pytest
+
+import gcp_audit
+from util.asset_inventory import (AssetInventory, AssetInventoryError,
+                                  OBJECT_ASSET)
+from util.results import ResultsStore
+
+PROJECT = '//cloudresourcemanager.googleapis.com/projects/%s'
+STORAGE = 'https://www.googleapis.com/storage/v1/b/'
+
+# Shaped like real exports - projects are only ever referred to by number,
+# bar the firewall selfLink and Project assets
+ASSETS = [
+    {'name': '//storage.googleapis.com/public-bucket',
+     'asset_type': 'storage.googleapis.com/Bucket',
+     'ancestors': ['projects/123456', 'organizations/1'],
+     'resource': {'parent': PROJECT % 123456, 'data': {
+         'name': 'public-bucket',
+         'projectNumber': '123456',
+         'selfLink': STORAGE + 'public-bucket',
+         'acl': [{'id': 'public-bucket/allUsers',
+                  'entity': 'allUsers',
+                  'role': 'READER'}]}}},
+    {'name': '//storage.googleapis.com/private-bucket',
+     'asset_type': 'storage.googleapis.com/Bucket',
+     'ancestors': ['projects/123456', 'organizations/1'],
+     'resource': {'parent': PROJECT % 123456, 'data': {
+         'name': 'private-bucket',
+         'projectNumber': '123456',
+         'selfLink': STORAGE + 'private-bucket'}}},
+    {'name': '//storage.googleapis.com/other-bucket',
+     'asset_type': 'storage.googleapis.com/Bucket',
+     'ancestors': ['projects/654321', 'organizations/1'],
+     'resource': {'parent': PROJECT % 654321, 'data': {
+         'name': 'other-bucket',
+         'projectNumber': '654321',
+         'selfLink': STORAGE + 'other-bucket',
+         'acl': [{'entity': 'allUsers', 'role': 'READER'}]}}},
+    {'name': '//storage.googleapis.com/public-bucket/objects/test_object',
+     'asset_type': 'storage.googleapis.com/Object',
+     'ancestors': ['projects/123456', 'organizations/1'],
+     'resource': {'data': {
+         'name': 'test_object',
+         'bucket': 'public-bucket',
+         'acl': [{'entity': 'allUsers', 'role': 'READER'}]}}},
+    {'name': '//compute.googleapis.com/projects/infect-testing/global/firewalls/test',
+     'asset_type': 'compute.googleapis.com/Firewall',
+     'ancestors': ['projects/123456', 'organizations/1'],
+     'resource': {'parent': PROJECT % 123456, 'data': {
+         'name': 'test',
+         'selfLink': ('https://www.googleapis.com/compute/v1/projects/'
+                      'infect-testing/global/firewalls/test'),
+         'allowed': [{'IPProtocol': 'all'}],
+         'sourceRanges': ['0.0.0.0/0']}}},
+    {'name': PROJECT % 654321,
+     'asset_type': 'cloudresourcemanager.googleapis.com/Project',
+     'ancestors': ['projects/654321', 'organizations/1'],
+     'resource': {'data': {'projectId': 'other-project',
+                           'projectNumber': '654321'}}},
+]
+
+# --content-type iam-policy exports have the policy on its own line
+POLICIES = [
+    {'name': '//storage.googleapis.com/private-bucket',
+     'asset_type': 'storage.googleapis.com/Bucket',
+     'ancestors': ['projects/123456', 'organizations/1'],
+     'iam_policy': {'bindings': [
+         {'role': 'roles/storage.admin', 'members': ['user:sre@example.com']},
+         {'role': 'roles/storage.objectViewer', 'members': ['allUsers']}]}},
+]
+
+
+def write_export(tmpdir):
+    export = tmpdir.join('export.json')
+    export.write('\n'.join(json.dumps(asset) for asset in ASSETS) +
+                 '\nnot json storage.googleapis.com/Bucket\n')
+    tmpdir.join('policies.json').write(
+        '\n'.join(json.dumps(asset) for asset in POLICIES))
+    return str(tmpdir)
+
+
+def test_buckets_filtered_by_project(tmpdir):
+
+    export = write_export(tmpdir)
+
+    # id from the firewall selfLink, id from the Project asset, and number
+    assert AssetInventory(export, project='infect-testing').buckets == [
+        'public-bucket', 'private-bucket']
+    assert AssetInventory(export, project='other-project').buckets == [
+        'other-bucket']
+    assert AssetInventory(export, project='123456').buckets == [
+        'public-bucket', 'private-bucket']
+
+
+def test_unknown_project_id_rejected(tmpdir):
+
+    with pytest.raises(AssetInventoryError):
+        AssetInventory(write_export(tmpdir), project='missing-project')
+
+
+def test_checks_read_export(tmpdir, monkeypatch):
+
+    inventory = AssetInventory(write_export(tmpdir), project='infect-testing')
+    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=ResultsStore())
+
+    gcp_audit.check_firewall_rules(inventory)
+    gcp_audit.check_bucket_acl(inventory)
+    gcp_audit.check_objects_acl(inventory)
+
+    shame = list(gcp_audit.LIST_OF_SHAME)
+    assert [(item.name, item.type_) for item in shame] == [
+        ('test', 'compute#firewall'),
+        ('public-bucket', 'Bucket'),
+        ('private-bucket', 'Bucket'),
+        ('test_object', 'Bucket Object'),
+    ]
+    assert shame[0].info['ports'] == 'all'
+    assert shame[2].info['role'] == 'roles/storage.objectViewer'
+    assert gcp_audit.LIST_OF_SHAME.count_by('project') == {'infect-testing': 4}
+
+
+def test_export_directory(tmpdir):
+
+    write_export(tmpdir)
+    tmpdir.join('README.txt').write('not an export')
+
+    inventory = AssetInventory(str(tmpdir.join('export.json')))
+    assert inventory.buckets == ['public-bucket', 'private-bucket', 'other-bucket']
+
+    inventory = AssetInventory(str(tmpdir))
+
+    assert inventory.buckets == ['public-bucket', 'private-bucket', 'other-bucket']
+
+
+def test_missing_objects_warned(tmpdir, caplog):
+
+    export = tmpdir.join('export.json')
+    export.write('\n'.join(json.dumps(asset) for asset in ASSETS
+                           if asset['asset_type'] != OBJECT_ASSET))
+
+    assert list(AssetInventory(str(export)).get_all_objects_acls()) == []
+    assert 'object acls were not checked' in caplog.text
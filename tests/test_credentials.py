@@ -0,0 +1,95 @@
+# pylint: disable-all
+import datetime
+import json
+
+import pytest
+import rsa
+from oauth2client.service_account import ServiceAccountCredentials
+
+from util.credentials import TokenProvider
+
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+@pytest.fixture(scope='module')
+def keyfile(tmpdir_factory):
+    _, private_key = rsa.newkeys(512)
+    path = tmpdir_factory.mktemp('keys').join('key.json')
+    path.write(json.dumps({
+        'type': 'service_account',
+        'private_key_id': 'abc',
+        'private_key': private_key.save_pkcs1().decode(),
+        'client_email': 'audit@infect-testing.iam.gserviceaccount.com',
+        'client_id': '1',
+    }))
+    return str(path)
+
+
+@pytest.fixture
+def exchanges(monkeypatch):
+    """fakes the token exchange, counting how often it happens"""
+
+    tokens = []
+
+    def do_refresh_request(self, http):
+        tokens.append('token-%s' % len(tokens))
+        self.access_token = tokens[-1]
+        self.token_expiry = (datetime.datetime.utcnow() +
+                             datetime.timedelta(hours=1))
+        self.store.locked_put(self)
+
+    monkeypatch.setattr(ServiceAccountCredentials, '_do_refresh_request',
+                        do_refresh_request)
+    return tokens
+
+
+def test_keyfile_parsed_once(keyfile, tmpdir, mocker):
+
+    parse = mocker.spy(ServiceAccountCredentials, 'from_json_keyfile_name')
+    provider = TokenProvider(str(tmpdir.join('tokens.json')))
+
+    assert provider.credentials(keyfile, SCOPES) is provider.credentials(
+        keyfile, SCOPES)
+    assert parse.call_count == 1
+
+
+def test_token_shared_between_processes(keyfile, tmpdir, exchanges):
+
+    cache = str(tmpdir.join('tokens.json'))
+    first = TokenProvider(cache).credentials(keyfile, SCOPES)
+    first.get_access_token()
+
+    # a second process picks up the cached token without an exchange
+    second = TokenProvider(cache).credentials(keyfile, SCOPES)
+
+    assert second.get_access_token().access_token == 'token-0'
+    assert exchanges == ['token-0']
+    assert oct(tmpdir.join('tokens.json').stat().mode)[-3:] == '600'
+
+
+def test_refresh_before_expiry(keyfile, tmpdir, exchanges):
+
+    cache = str(tmpdir.join('tokens.json'))
+    credentials = TokenProvider(cache).credentials(keyfile, SCOPES)
+    credentials.get_access_token()
+
+    TokenProvider.refresh_if_expiring(credentials)
+    assert exchanges == ['token-0']
+
+    credentials.token_expiry = (datetime.datetime.utcnow() +
+                                datetime.timedelta(minutes=2))
+    credentials.store.put(credentials)
+    # nearly expired tokens aren't handed out
+    other = TokenProvider(cache).credentials(keyfile, SCOPES)
+    assert other.access_token is None
+
+    TokenProvider.refresh_if_expiring(credentials)
+    assert credentials.access_token == 'token-1'
+
+    # another process sees the new token is fresh and reuses it
+    other.access_token = 'token-0'
+    other.token_expiry = (datetime.datetime.utcnow() +
+                          datetime.timedelta(minutes=2))
+    TokenProvider.refresh_if_expiring(other)
+    assert other.access_token == 'token-1'
+    assert exchanges == ['token-0', 'token-1']
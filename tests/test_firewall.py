@@ -0,0 +1,138 @@
+# pylint: disable-all
+import ipaddress
+import random
+
+from util.firewall import FirewallIndex, IntervalIndex, _subnet_of
+from util.gcp import firewall_record
+
+
+def rule(name, ranges, allowed=None, denied=None, priority=1000,
+         network='default', targets=None, project='infect-testing'):
+    resource = {'name': name,
+                'kind': 'compute#firewall',
+                'network': ('https://www.googleapis.com/compute/v1/projects/'
+                            '%s/global/networks/%s' % (project, network)),
+                'direction': 'INGRESS',
+                'priority': priority,
+                'sourceRanges': ranges,
+                'targetTags': targets or []}
+    if denied:
+        resource['denied'] = denied
+    else:
+        resource['allowed'] = allowed
+    return firewall_record(resource)
+
+
+def test_interval_index_matches_brute_force():
+
+    rand = random.Random(1)
+    intervals = []
+    for value in range(300):
+        start = rand.randint(0, 1000)
+        intervals.append((start, start + rand.randint(0, 200), value))
+    index = IntervalIndex(intervals)
+
+    for _ in range(200):
+        start = rand.randint(0, 1200)
+        end = start + rand.randint(0, 50)
+        assert sorted(index.overlapping(start, end)) == sorted(
+            value for low, high, value in intervals
+            if low <= end and start <= high)
+        assert sorted(index.containing(start, end)) == sorted(
+            value for low, high, value in intervals
+            if low <= start and end <= high)
+
+
+def test_subnet_of():
+
+    net = ipaddress.ip_network
+
+    assert _subnet_of(net('10.1.0.0/16'), net('10.0.0.0/8'))
+    assert _subnet_of(net('10.0.0.0/8'), net('10.0.0.0/8'))
+    assert not _subnet_of(net('10.0.0.0/8'), net('10.1.0.0/16'))
+    assert not _subnet_of(net('11.0.0.0/16'), net('10.0.0.0/8'))
+    assert not _subnet_of(net('::/0'), net('0.0.0.0/0'))
+
+
+def test_sensitive_port_in_range_exposed():
+
+    wide = rule('wide', ['0.0.0.0/1', '128.0.0.0/1'],
+                allowed=[{'IPProtocol': 'tcp', 'ports': ['1-65535']}])
+    web = rule('web', ['0.0.0.0/0'],
+               allowed=[{'IPProtocol': 'tcp', 'ports': ['80', '443']}])
+    office = rule('office', ['203.0.113.7/32'],
+                  allowed=[{'IPProtocol': 'tcp', 'ports': ['22']}])
+    internal = rule('internal', ['10.0.0.0/8'],
+                    allowed=[{'IPProtocol': 'all'}])
+    index = FirewallIndex([wide, web, office, internal])
+
+    assert index.exposing(22) == [wide]
+    assert index.exposing(443) == [wide, web]
+    assert index.exposing(22, protocol='udp') == []
+    assert index.exposed_rules() == [wide]
+
+
+def test_deny_blocks_exposure():
+
+    allow = rule('allow-ssh', ['0.0.0.0/0'],
+                 allowed=[{'IPProtocol': 'tcp', 'ports': ['22']}])
+    deny = rule('deny-ssh', ['0.0.0.0/0'],
+                denied=[{'IPProtocol': 'tcp', 'ports': ['20-25']}],
+                priority=100)
+    other_network = rule('deny-ssh-other', ['0.0.0.0/0'],
+                         denied=[{'IPProtocol': 'all'}],
+                         priority=100, network='other')
+
+    assert FirewallIndex([allow, deny]).exposing(22) == []
+    assert FirewallIndex([allow, other_network]).exposing(22) == [allow]
+    assert FirewallIndex([allow, deny]).shadowed() == [(allow, deny)]
+
+
+def test_shadowed_respects_targets_and_overlap():
+
+    broad = rule('broad', ['10.0.0.0/8'],
+                 allowed=[{'IPProtocol': 'tcp'}], priority=10)
+    narrow = rule('narrow', ['10.1.0.0/16'],
+                  allowed=[{'IPProtocol': 'tcp', 'ports': ['8080']}],
+                  targets=['web'])
+    tagged = rule('tagged', ['10.0.0.0/8'],
+                  allowed=[{'IPProtocol': 'tcp'}], priority=10,
+                  targets=['db'])
+    other = rule('other', ['10.1.2.0/24'],
+                 allowed=[{'IPProtocol': 'udp', 'ports': ['53']}])
+
+    assert FirewallIndex([broad, narrow]).shadowed() == [(narrow, broad)]
+    assert FirewallIndex([tagged, narrow]).shadowed() == []
+
+    index = FirewallIndex([broad, narrow, other])
+    assert index.overlapping(narrow) == [broad]
+    assert index.overlapping(other) == []
+
+
+def test_default_networks_in_other_projects_kept_apart():
+
+    allow = rule('allow-ssh', ['0.0.0.0/0'],
+                 allowed=[{'IPProtocol': 'tcp', 'ports': ['22']}],
+                 project='proj-a')
+    deny = rule('deny-all', ['0.0.0.0/0'],
+                denied=[{'IPProtocol': 'all'}], priority=100,
+                project='proj-b')
+    index = FirewallIndex([allow, deny])
+
+    assert allow.rule['network'] == 'projects/proj-a/global/networks/default'
+    assert index.exposed_rules() == [allow]
+    assert index.shadowed() == []
+
+
+def test_all_protocol_rule_blocked_by_deny():
+
+    allow = rule('allow-all', ['0.0.0.0/0'], allowed=[{'IPProtocol': 'all'}])
+    deny = rule('deny-all', ['0.0.0.0/0'], denied=[{'IPProtocol': 'all'}],
+                priority=100)
+    deny_ssh = rule('deny-ssh', ['0.0.0.0/0'],
+                    denied=[{'IPProtocol': 'tcp', 'ports': ['22']}],
+                    priority=100)
+
+    assert FirewallIndex([allow, deny]).exposed_rules() == []
+    assert FirewallIndex([allow, deny_ssh]).exposed_rules() == [allow]
+    assert sorted(allow.info) == ['ports', 'protocol', 'ranges']
@@ -2,6 +2,7 @@
 from collections import namedtuple
 import gcp_audit
 from util.gcp import Gcp
+from util.results import ResultsStore
 
 from unittest.mock import MagicMock
 
@@ -9,6 +10,9 @@ import pytest
 
 MockTuple = namedtuple('MockTuple', ['name', 'type_', 'info'])
 
+def shame():
+    return [(row.name, row.type_, row.info) for row in gcp_audit.LIST_OF_SHAME]
+
 def test_check_firewall_rules(mocker, monkeypatch):
 
     issue = "targets and/or ports open to all"
@@ -28,12 +32,12 @@ def test_check_firewall_rules(mocker, monkeypatch):
     gcp = Gcp()
     monkeypatch.setattr(gcp, 'project', value='infect-testing')
     monkeypatch.setattr(gcp, 'get_full_firewall_rules', mock_fw)
-    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=[])
+    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=ResultsStore())
     mock_full_firewall_rules = mocker.patch.object(gcp, 'get_full_firewall_rules')
     mock_full_firewall_rules.return_value = mock_fw()
     event = gcp_audit.check_firewall_rules(gcp)
 
-    assert gcp_audit.LIST_OF_SHAME == mock_fw()
+    assert shame() == [tuple(item) for item in mock_fw()]
 
 def test_check_firewall_secure(mocker, monkeypatch):
 
@@ -49,9 +53,10 @@ def test_check_firewall_secure(mocker, monkeypatch):
     gcp = Gcp()
     monkeypatch.setattr(gcp, 'project', value='infect-testing')
     monkeypatch.setattr(gcp, 'get_full_firewall_rules', mock_fw)
+    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=ResultsStore())
     event = gcp_audit.check_firewall_rules(gcp)
 
-    assert gcp_audit.LIST_OF_SHAME == []
+    assert shame() == []
 
 def test_check_bucket_acl(mocker, monkeypatch):
 
@@ -68,9 +73,10 @@ def test_check_bucket_acl(mocker, monkeypatch):
     gcp = Gcp()
     monkeypatch.setattr(gcp, 'project', value='infect-testing')
     monkeypatch.setattr(gcp, 'get_all_bucket_acl', mock_acl)
+    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=ResultsStore())
     event = gcp_audit.check_bucket_acl(gcp)
 
-    assert gcp_audit.LIST_OF_SHAME == mock_acl()
+    assert shame() == [tuple(item) for item in mock_acl()]
 
 def test_check_objects_acl(mocker, monkeypatch):
 
@@ -88,7 +94,17 @@ def test_check_objects_acl(mocker, monkeypatch):
     gcp = Gcp()
     monkeypatch.setattr(gcp, 'project', value='infect-testing')
     monkeypatch.setattr(gcp, 'get_all_objects_acls', mock_obj_acl)
-    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=[])
+    monkeypatch.setattr(gcp_audit, 'LIST_OF_SHAME', value=ResultsStore())
     event = gcp_audit.check_objects_acl(gcp)
 
-    assert gcp_audit.LIST_OF_SHAME == mock_obj_acl()
+    assert shame() == [tuple(item) for item in mock_obj_acl()]
+
+def test_export_without_project_needs_dump_project(monkeypatch):
+
+    monkeypatch.setattr('sys.argv', ['gcp_audit.py', '--asset-export', 'x'])
+    with pytest.raises(SystemExit):
+        gcp_audit.argument_parser()
+
+    monkeypatch.setattr('sys.argv', ['gcp_audit.py', '--asset-export', 'x',
+                                     '--dump-project', 'audit'])
+    assert gcp_audit.argument_parser().dump_project == 'audit'
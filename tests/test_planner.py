@@ -0,0 +1,175 @@
+# pylint: disable-all
+from collections import namedtuple
+from unittest.mock import MagicMock
+
+from googleapiclient.errors import HttpError
+
+from util import gcp as gcp_module, planner
+from util.gcp import Gcp
+
+Obj = namedtuple('AllObjects', ['bucket', 'name'])
+
+
+def mock_gcp(object_pages):
+    gcp = MagicMock()
+    gcp.project = 'infect-testing'
+    gcp.buckets = list(object_pages)
+
+    storage = gcp.storage_session
+    storage.buckets().list().execute.return_value = {'items': [
+        {'name': 'uniform',
+         'iamConfiguration': {'uniformBucketLevelAccess': {'enabled': True}}},
+    ]}
+
+    def list_objects(bucket, maxResults):
+        page = object_pages[bucket]
+        if isinstance(page, Exception):
+            return MagicMock(execute=MagicMock(side_effect=page))
+        return MagicMock(execute=MagicMock(return_value=page))
+
+    storage.objects().list.side_effect = list_objects
+    gcp.compute_session.firewalls().list().execute.return_value = {
+        'items': [{'name': 'a'}, {'name': 'b'}]}
+    return gcp
+
+
+def test_plan_strategies_and_estimates():
+
+    page = {'items': [{}] * 1000}
+    plan = planner.plan_scan(mock_gcp({
+        'small': {'items': [{}] * 10},
+        'medium': page,
+        'huge': dict(page, nextPageToken='x'),
+        'empty': {},
+        'uniform': page,
+    }), sample=True)
+
+    assert {bucket: plan.strategy(bucket) for bucket in plan.buckets} == {
+        'small': 'inline', 'medium': 'batch', 'huge': 'sample',
+        'empty': 'skip', 'uniform': 'skip'}
+    assert plan.uniform('uniform') and not plan.uniform('huge')
+    assert plan.firewalls == 2
+    # lists + firewalls + bucket acls and listings + object acls
+    assert plan.api_calls == 2 + 2 + (2 + 2 + 2 + 1) + (10 + 1000 + 100)
+    assert plan.requests == 2 + 2 + (2 + 2 + 2 + 1) + (10 + 10 + 1)
+    assert plan.sampled == ['huge']
+    assert 'sampled buckets: huge' in plan.format()
+
+
+def test_sampling_is_opt_in():
+
+    page = {'items': [{}] * 1000, 'nextPageToken': 'x'}
+    plan = planner.plan_scan(mock_gcp({'huge': page}))
+
+    assert plan.strategy('huge') == 'batch'
+    assert plan.sampled == []
+    assert plan.take_page('huge') is page
+    assert plan.take_page('huge') is None
+
+
+def test_unsampled_bucket_checked_inline():
+
+    error = HttpError(MagicMock(status=500), b'backend error')
+    plan = planner.plan_scan(mock_gcp({'broken': error}))
+
+    assert plan.strategy('broken') == 'inline'
+    assert plan.buckets['broken'].objects is None
+    assert 'unknown' in plan.format()
+    assert plan.memory == 0
+
+
+def test_objects_acls_follow_plan(monkeypatch):
+
+    objects = ([Obj('small', 'a')] + [Obj('huge', str(i)) for i in range(500)])
+    plan = planner.ScanPlan([
+        planner._bucket_plan('small', 1, False, False),
+        planner._bucket_plan('huge', 1000, True, False, sample=True),
+    ])
+    inline, batched = [], []
+
+    gcp = Gcp()
+    gcp.plan = plan
+    monkeypatch.setattr(gcp, '_get_all_objects', lambda: objects)
+    monkeypatch.setattr(gcp, '_get_objects_acls_inline',
+                        lambda objs: inline.extend(objs) or [])
+    monkeypatch.setattr(gcp, '_get_objects_acls_batched',
+                        lambda objs: batched.extend(objs) or [])
+    gcp.get_all_objects_acls()
+
+    assert inline == [Obj('small', 'a')]
+    assert len(batched) == planner.SAMPLE_SIZE
+    assert all(obj.bucket == 'huge' for obj in batched)
+
+
+def test_objects_reuse_planned_page():
+
+    def item(name):
+        return {'bucket': 'big', 'name': name}
+
+    plan = planner.ScanPlan(
+        [planner._bucket_plan('big', 2, True, False)],
+        pages={'big': {'items': [item('a'), item('b')], 'nextPageToken': 't'}})
+    gcp = Gcp()
+    gcp.plan = plan
+    gcp.buckets = ['big']
+    gcp.storage_session = MagicMock()
+    gcp.storage_session.objects().list().execute.return_value = {
+        'items': [item('c')]}
+    gcp.storage_session.objects().list.reset_mock()
+
+    assert [obj.name for obj in gcp._get_all_objects()] == ['a', 'b', 'c']
+    gcp.storage_session.objects().list.assert_called_once_with(
+        bucket='big', pageToken='t')
+
+
+def http_error(status):
+    return HttpError(MagicMock(status=status), b'error')
+
+
+def test_transient_batch_items_retried_inline(monkeypatch):
+
+    class FakeBatch(object):
+        def __init__(self, callback, batch_uri):
+            self.callback = callback
+            self.request_ids = []
+
+        def add(self, request, request_id):
+            self.request_ids.append(request_id)
+
+        def execute(self):
+            if len(self.request_ids) == 1:
+                raise http_error(503)
+            self.callback('0', {'items': []}, None)
+            self.callback('1', None, http_error(503))
+            self.callback('2', None, http_error(403))
+
+    monkeypatch.setattr(gcp_module, 'BatchHttpRequest', FakeBatch)
+    monkeypatch.setattr(gcp_module, 'BATCH_SIZE', 3)
+    objects = [Obj('big', str(i)) for i in range(4)]
+    retried = []
+
+    gcp = Gcp()
+    gcp.storage_session = MagicMock()
+    monkeypatch.setattr(gcp, '_get_objects_acls_inline',
+                        lambda objs: retried.extend(objs) or [])
+    gcp._get_objects_acls_batched(objects)
+
+    assert retried == [Obj('big', '1'), Obj('big', '3')]
+
+
+def test_inline_only_retries_transient_errors(monkeypatch):
+
+    sleeps = []
+    monkeypatch.setattr(gcp_module.time, 'sleep', sleeps.append)
+    gcp = Gcp()
+    gcp.storage_session = MagicMock()
+    acls = gcp.storage_session.objectAccessControls().list().execute
+
+    acls.side_effect = [http_error(403)]
+    assert gcp._get_objects_acls_inline([Obj('big', 'a')]) == []
+    assert sleeps == []
+
+    acls.side_effect = [http_error(429), http_error(500), {'items': []}]
+    assert gcp._get_objects_acls_inline([Obj('big', 'a')]) == []
+    assert len(sleeps) == 2
+    assert acls.call_count == 4
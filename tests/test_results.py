@@ -0,0 +1,88 @@
+# pylint: disable-all
+import gzip
+
+import pytest
+
+from util.gcp import AllTuple
+from util.generate import generate_summary_message
+from util.results import ResultsStore, ResultsStoreError
+
+RECORDS = [
+    AllTuple(name='bucket-a', type_='Bucket',
+             info={'id': 'bucket-a/allUsers', 'entity': 'allUsers',
+                   'role': 'READER'}, project=''),
+    AllTuple(name='obj-1', type_='Bucket Object',
+             info={'bucket': 'bucket-a', 'entity': 'allUsers',
+                   'role': 'READER', 'id': 'x'}, project=''),
+    AllTuple(name='obj-2', type_='Bucket Object',
+             info={'bucket': 'bucket-b', 'entity': 'allAuthenticatedUsers',
+                   'role': 'OWNER', 'id': 'y'}, project=''),
+]
+
+
+def test_count_by():
+
+    store = ResultsStore(RECORDS, project='infect-testing')
+
+    assert len(store) == 3
+    assert store.count_by('bucket') == {'bucket-a': 2, 'bucket-b': 1}
+    assert store.count_by('project', 'entity') == {
+        ('infect-testing', 'allUsers'): 2,
+        ('infect-testing', 'allAuthenticatedUsers'): 1}
+    assert store.values('name') == ['bucket-a', 'obj-1', 'obj-2']
+
+
+def test_rows_keep_own_project_and_info():
+
+    firewall = AllTuple(name='test', type_='compute#firewall',
+                        info={'protocol': 'all', 'ranges': ['0.0.0.0/0'],
+                              'ports': 'all'},
+                        project='proj-a')
+    store = ResultsStore(RECORDS[1:2] + [firewall], project='infect-testing')
+
+    assert [tuple(row) for row in store] == [
+        ('obj-1', 'Bucket Object',
+         {'bucket': 'bucket-a', 'entity': 'allUsers', 'role': 'READER'},
+         'infect-testing'),
+        ('test', 'compute#firewall', firewall.info, 'proj-a'),
+    ]
+
+
+def test_save_and_load(tmpdir):
+
+    path = str(tmpdir.join('results.gz'))
+    store = ResultsStore(RECORDS, project='infect-testing')
+    store.extend(RECORDS[:1], project='other-project')
+    store.save(path)
+
+    loaded = ResultsStore.load(path)
+
+    for column in ['project', 'type_', 'name', 'bucket', 'entity', 'role',
+                   'detail']:
+        assert loaded.values(column) == store.values(column)
+    loaded.append(RECORDS[2], project='other-project')
+    assert loaded.count_by('project') == {'infect-testing': 3,
+                                          'other-project': 2}
+
+
+def test_load_rejects_other_files(tmpdir):
+
+    path = str(tmpdir.join('results.gz'))
+    with gzip.open(path, 'wb') as results_file:
+        results_file.write(b'{"not": "results"}\n')
+
+    with pytest.raises(ResultsStoreError):
+        ResultsStore.load(path)
+
+
+def test_summary_message():
+
+    msg = generate_summary_message(ResultsStore(RECORDS), 'infect-testing')
+
+    assert msg.startswith('Summary of 3 violations in *infect-testing*')
+    assert '*Bucket*: `bucket-a`: 2, `bucket-b`: 1\n' in msg
+    assert '*Project*' not in msg
+
+    msg = generate_summary_message(ResultsStore(RECORDS, project='proj-a'),
+                                   'all exported projects')
+    assert '*Project*: `proj-a`: 3\n' in msg
@@ -0,0 +1,22 @@
+# pylint: disable-all
+from util.transport import FieldMaskRequest
+
+
+def test_field_mask_added():
+
+    req = FieldMaskRequest(None, None,
+                           'https://storage.googleapis.com/storage/v1/b?project=x',
+                           methodId='storage.buckets.list')
+
+    assert req.uri == ('https://storage.googleapis.com/storage/v1/b?project=x'
+                       '&fields=items%28name%29%2CnextPageToken')
+
+
+def test_explicit_fields_and_unknown_methods_untouched():
+
+    uri = 'https://storage.googleapis.com/storage/v1/b/b/o?fields=items%28name%29'
+    req = FieldMaskRequest(None, None, uri, methodId='storage.objects.list')
+
+    assert req.uri == uri
+    assert FieldMaskRequest(None, None, 'https://x/y',
+                            methodId='storage.buckets.get').uri == 'https://x/y'
@@ -0,0 +1,325 @@
+"""read bucket/firewall data from a Cloud Asset Inventory export
+
+Asset Inventory can export every resource in an organisation as NDJSON,
+one asset per line. Reading such an export locally turns an org-wide audit
+into a CPU-bound job instead of millions of API calls. Files are streamed
+line by line and the getters are generators, so the export is never loaded
+into memory in full.
+
+Asset Inventory doesn't export storage objects, so object ACLs aren't
+checked in export mode.
+"""
+import gzip
+import json
+import logging
+import os
+
+from .gcp import Gcp, AllTuple, firewall_record
+
+LOG = logging.getLogger(__name__)
+
+BUCKET_ASSET = 'storage.googleapis.com/Bucket'
+OBJECT_ASSET = 'storage.googleapis.com/Object'
+FIREWALL_ASSET = 'compute.googleapis.com/Firewall'
+PROJECT_ASSET = 'cloudresourcemanager.googleapis.com/Project'
+
+EXPORT_SUFFIXES = ('.json', '.ndjson', '.jsonl', '.gz')
+
+
+class AssetInventoryError(Exception):
+    """Raised when the export can't be matched to the project asked for"""
+    pass
+
+
+class AssetInventory(Gcp):
+    """Drop-in replacement for Gcp which reads resources from a local
+    Asset Inventory export rather than the storage and compute APIs.
+    Yields the same records as Gcp so the checks in gcp_audit work
+    unchanged.
+
+    The export should be taken with the RESOURCE content type, and
+    optionally IAM_POLICY too so public bucket IAM bindings are picked up.
+
+    Exports refer to projects by number. A project id is resolved to its
+    number from Project assets or firewall selfLinks in the export, and
+    AssetInventoryError is raised if it can't be.
+    """
+
+    def __init__(self,
+                 export_path,
+                 project='',
+                 whitelist=''):
+        # pylint: disable=super-init-not-called
+        # No sessions needed - everything comes from the export
+        self.storage_session = None
+        self.compute_session = None
+        self.export_files = self._find_export_files(export_path)
+        self.project = project
+        self._project_ids = self._find_project_ids()
+        self._aliases = self._project_aliases(project)
+        self.config_results = {'buckets': False,
+                               'objects': False}
+        self.whitelist = self._load_whitelist_file(whitelist) if whitelist else None
+        self.buckets = self._get_all_buckets()
+        self.plan = None
+
+    @staticmethod
+    def _find_export_files(export_path):
+        """returns the export file, or every export shard in a directory"""
+
+        export_path = os.path.expanduser(export_path)
+
+        if os.path.isdir(export_path):
+            return sorted(
+                os.path.join(export_path, name)
+                for name in os.listdir(export_path)
+                if name.endswith(EXPORT_SUFFIXES)
+            )
+
+        return [export_path]
+
+    @staticmethod
+    def _project_number(asset):
+        """the number of the project an asset is in, from its ancestors or
+        parent, or '' if it has neither"""
+
+        for ancestor in asset.get('ancestors', []):
+            if ancestor.startswith('projects/'):
+                return ancestor.split('/')[1]
+
+        parent = asset.get('resource', {}).get('parent', '')
+        if '/projects/' in parent:
+            return parent.split('/projects/')[-1].split('/')[0]
+
+        return ''
+
+    def _find_project_ids(self):
+        """maps project numbers to ids, from Project assets and the
+        selfLinks of firewall rules, which have the id in them"""
+
+        project_ids = {}
+
+        for asset in self._read_assets(PROJECT_ASSET):
+            data = asset.get('resource', {}).get('data', {})
+            if data.get('projectId') and data.get('projectNumber'):
+                project_ids[str(data['projectNumber'])] = data['projectId']
+
+        for asset in self._read_assets(FIREWALL_ASSET):
+            number = self._project_number(asset)
+            link = asset.get('resource', {}).get('data', {}).get('selfLink', '')
+            if number and '/projects/' in link:
+                project_ids.setdefault(
+                    number, link.split('/projects/')[1].split('/')[0])
+
+        return project_ids
+
+    def _project_aliases(self, project):
+        """the id and number project may appear as in the export"""
+
+        if not project:
+            return set()
+
+        aliases = {str(project)}
+        aliases.update(number for number, project_id in self._project_ids.items()
+                       if project_id == project)
+        if str(project) in self._project_ids:
+            aliases.add(self._project_ids[str(project)])
+
+        if not any(alias.isdigit() for alias in aliases):
+            raise AssetInventoryError(
+                'project number for %r not found in the export - pass the '
+                'project number with -p instead' % project)
+
+        return aliases
+
+    def _in_project(self, asset):
+        """checks asset belongs to self.project, by project number or id"""
+
+        if not self.project:
+            return True
+
+        if self._project_number(asset) in self._aliases:
+            return True
+
+        data = asset.get('resource', {}).get('data', {})
+        if str(data.get('projectNumber', '')) in self._aliases:
+            return True
+
+        return any('/projects/%s/' % alias in data.get('selfLink', '')
+                   for alias in self._aliases)
+
+    def _asset_project(self, asset):
+        """the project an asset is in, as an id if the export tells us it,
+        otherwise as a number"""
+
+        number = self._project_number(asset)
+        return self._project_ids.get(number, number) or self.project or ''
+
+    def _read_assets(self, asset_type):
+        """streams assets of asset_type out of the export files"""
+
+        # Cheap substring test so we only json decode lines we care about
+        needle = asset_type.encode('utf-8')
+
+        for export_file in self.export_files:
+            opener = gzip.open if export_file.endswith('.gz') else open
+            try:
+                with opener(export_file, 'rb') as export:
+                    for line_no, line in enumerate(export, 1):
+                        if needle not in line:
+                            continue
+                        try:
+                            asset = json.loads(line)
+                        except ValueError:
+                            LOG.error('%s:%r is not valid json - skipping' %
+                                      (export_file, line_no))
+                            continue
+                        if asset.get('asset_type') == asset_type:
+                            yield asset
+            except OSError as error:
+                LOG.error('export file %r not readable: %s', export_file, error)
+
+    def _iter_assets(self, asset_type):
+        """streams assets of asset_type in self.project"""
+
+        for asset in self._read_assets(asset_type):
+            if self._in_project(asset):
+                yield asset
+
+    @staticmethod
+    def _bucket_name(asset):
+        """bucket name from an asset name, //storage.googleapis.com/<bucket>.
+        IAM policy lines carry no resource data to take it from"""
+
+        return asset['name'].split('/')[-1]
+
+    def _get_all_buckets(self):
+        """gets the names of all buckets in the export, minus any
+        whitelisted buckets"""
+
+        buckets = []
+        for asset in self._iter_assets(BUCKET_ASSET):
+            bucket = self._bucket_name(asset)
+            if bucket not in buckets:
+                buckets.append(bucket)
+
+        if self.config_results['buckets']:
+            for bucket in self.whitelist['buckets']:
+                try:
+                    buckets.remove(bucket)
+                except ValueError:
+                    LOG.info('Whitelist: %r not found so ignoring' % bucket)
+
+        return buckets
+
+    def _get_iam_bindings(self):
+        """gets IAM bindings and the project of each bucket with a policy.
+        An iam-policy export has the policy on its own line, without the
+        resource"""
+
+        bindings = {}
+
+        for asset in self._iter_assets(BUCKET_ASSET):
+            policy = asset.get('iam_policy')
+            if policy:
+                bucket = self._bucket_name(asset)
+                bindings.setdefault(bucket, (self._asset_project(asset), []))
+                bindings[bucket][1].extend(policy.get('bindings', []))
+
+        return bindings
+
+    def get_all_bucket_acl(self):
+        """yields bucket access controls from the export. Public IAM
+        bindings are yielded as access controls too, with the member as
+        the entity"""
+
+        buckets = set(self.buckets)
+        count = 0
+
+        for asset in self._iter_assets(BUCKET_ASSET):
+            if 'resource' not in asset:
+                continue
+            bucket = self._bucket_name(asset)
+            if bucket not in buckets:
+                continue
+
+            for item in asset['resource'].get('data', {}).get('acl', []):
+                count += 1
+                info = {
+                    'id': item.get('id', '%s/%s' % (bucket, item['entity'])),
+                    'entity': item['entity'],
+                    'role': item['role']
+                }
+                yield AllTuple(name=bucket, type_='Bucket', info=info,
+                               project=self._asset_project(asset))
+
+        for bucket, (project, bindings) in self._get_iam_bindings().items():
+            if bucket not in buckets:
+                continue
+            for binding in bindings:
+                for member in binding.get('members', []):
+                    count += 1
+                    info = {
+                        'id': '%s/%s' % (bucket, member),
+                        'entity': member,
+                        'role': binding['role']
+                    }
+                    yield AllTuple(name=bucket, type_='Bucket', info=info,
+                                   project=project)
+
+        LOG.info('processed %r bucket acls' % count)
+
+    def get_all_objects_acls(self):
+        """yields object access controls from any object assets in the
+        export. Asset Inventory doesn't export objects so there usually
+        aren't any, which is logged as a warning"""
+
+        buckets = set(self.buckets)
+        object_whitelist = []
+        count = 0
+        objects = 0
+
+        if self.config_results['objects']:
+            object_whitelist = self.whitelist['objects']
+
+        for asset in self._iter_assets(OBJECT_ASSET):
+            if 'resource' not in asset:
+                continue
+            objects += 1
+            data = asset['resource']['data']
+            if (data['bucket'] not in buckets or
+                    data['name'] in object_whitelist):
+                continue
+
+            for obj_acl in data.get('acl', []):
+                count += 1
+                info = {
+                    'bucket': data['bucket'],
+                    'entity': obj_acl['entity'],
+                    'role': obj_acl['role'],
+                    'id': obj_acl.get('id', '%s/%s/%s' % (
+                        data['bucket'], data['name'], obj_acl['entity']))
+                }
+                yield AllTuple(name=data['name'],
+                               type_='Bucket Object',
+                               info=info,
+                               project=self._asset_project(asset))
+
+        if not objects:
+            LOG.warning('no objects in the export - Asset Inventory does not '
+                        'export them, so object acls were not checked')
+        LOG.info('processed %r object acls' % count)
+
+    def get_full_firewall_rules(self):
+        """yields firewall rules from the export"""
+
+        count = 0
+
+        for asset in self._iter_assets(FIREWALL_ASSET):
+            if 'resource' not in asset:
+                continue
+            count += 1
+            yield firewall_record(asset['resource']['data'],
+                                  self._asset_project(asset))
+
+        LOG.info('processed %r rules' % count)
@@ -0,0 +1,233 @@
+"""shared, cached OAuth credentials
+
+Each keyfile is parsed once per process, and every session built from it
+shares the same credentials. Access tokens are kept in a locked cache file,
+so parallel workers and back to back cron runs reuse a token instead of
+all doing their own token exchange. A background thread refreshes tokens
+shortly before they expire so requests never wait on a refresh.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import httplib2
+from oauth2client.client import EXPIRY_FORMAT, Storage
+from oauth2client.client import HttpAccessTokenRefreshError
+from oauth2client.service_account import ServiceAccountCredentials
+
+try:
+    import fcntl
+except ImportError:
+    # No cross process locking on Windows, threads are still safe
+    fcntl = None
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_CACHE = os.environ.get(
+    'GCP_AUDIT_TOKEN_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'gcp_audit', 'tokens.json'))
+
+# Tokens this close to expiry are refreshed rather than reused
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+REFRESH_CHECK_SECONDS = 30
+
+
+class TokenCache(Storage):
+    """oauth2client Storage holding access tokens (never keys) in a json
+    file, locked against other threads and processes.
+
+    Args:
+        credentials: credentials the tokens belong to
+        key (str): cache entry for these credentials
+        path (str): cache file
+
+    """
+
+    def __init__(self, credentials, key, path=TOKEN_CACHE):
+        super().__init__(lock=threading.Lock())
+        self._credentials = credentials
+        self._key = key
+        self._path = path
+        self._lock_file = None
+
+    def acquire_lock(self):
+        """takes the thread lock, then the file lock"""
+
+        super().acquire_lock()
+        if fcntl is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            self._lock_file = open(self._path + '.lock', 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except OSError as error:
+            LOG.error('token cache not locked - using it anyway: %s', error)
+
+    def release_lock(self):
+        """releases the file lock, then the thread lock"""
+
+        if self._lock_file is not None:
+            # closing drops the flock
+            self._lock_file.close()
+            self._lock_file = None
+        super().release_lock()
+
+    def _read(self):
+        """returns the whole cache, empty if missing or unreadable"""
+
+        try:
+            with open(self._path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, cache):
+        """replaces the cache file, readable only by us"""
+
+        tmp_path = '%s.%s.tmp' % (self._path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT |
+                                   os.O_TRUNC, 0o600), 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_path, self._path)
+        except OSError as error:
+            LOG.error('could not write token cache %s: %s', self._path, error)
+
+    def locked_get(self):
+        """returns a copy of the credentials with the cached token, or None
+        if there isn't one that's good for a while yet"""
+
+        entry = self._read().get(self._key)
+        if not entry:
+            return None
+
+        expiry = datetime.datetime.strptime(entry['token_expiry'],
+                                            EXPIRY_FORMAT)
+        if expiry - datetime.datetime.utcnow() <= REFRESH_MARGIN:
+            return None
+
+        cached = self._credentials.__class__.__new__(self._credentials.__class__)
+        cached.__dict__.update(self._credentials.__dict__)
+        cached.access_token = entry['access_token']
+        cached.token_expiry = expiry
+        cached.invalid = False
+        return cached
+
+    def locked_put(self, credentials):
+        """caches the access token of credentials"""
+
+        if not credentials.access_token or not credentials.token_expiry:
+            return
+
+        cache = self._read()
+        cache[self._key] = {
+            'access_token': credentials.access_token,
+            'token_expiry': credentials.token_expiry.strftime(EXPIRY_FORMAT)
+        }
+        self._write(cache)
+
+    def locked_delete(self):
+        """drops the cached token"""
+
+        cache = self._read()
+        if cache.pop(self._key, None):
+            self._write(cache)
+
+
+class TokenProvider(object):
+    """Parses each keyfile once and shares the credentials between
+    sessions and threads. Tokens are cached in path and refreshed in the
+    background before they expire.
+
+    Args:
+        path (str): token cache file
+
+    """
+
+    def __init__(self, path=TOKEN_CACHE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._refresher = None
+
+    def credentials(self, key_file, scopes):
+        """returns the shared credentials for key_file and scopes
+
+        Args:
+            key_file (str): path to service file
+            scopes (List[str])
+
+        """
+
+        key = (os.path.abspath(os.path.expanduser(key_file)), tuple(scopes))
+
+        with self._lock:
+            if key not in self._credentials:
+                credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                    key_file, scopes=scopes)
+                store = TokenCache(credentials,
+                                   ' '.join((credentials.service_account_email,)
+                                            + tuple(scopes)),
+                                   path=self.path)
+                credentials.set_store(store)
+
+                # Pick up a token from an earlier run or another process
+                cached = store.get()
+                if cached:
+                    credentials.access_token = cached.access_token
+                    credentials.token_expiry = cached.token_expiry
+
+                self._credentials[key] = credentials
+                self._start_refresher()
+
+            return self._credentials[key]
+
+    def _start_refresher(self):
+        """starts the background refresh thread if it isn't running"""
+
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop,
+                                               name='token-refresher',
+                                               daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        """refreshes tokens that are close to expiry"""
+
+        while True:
+            time.sleep(REFRESH_CHECK_SECONDS)
+            with self._lock:
+                all_credentials = list(self._credentials.values())
+            for credentials in all_credentials:
+                self.refresh_if_expiring(credentials)
+
+    @staticmethod
+    def refresh_if_expiring(credentials):
+        """refreshes credentials if their token is within REFRESH_MARGIN of
+        expiry. Credentials which haven't fetched a token yet are left
+        alone. Another process' newer token is used if there is one."""
+
+        if not credentials.access_token or not credentials.token_expiry:
+            return
+        if (credentials.token_expiry - datetime.datetime.utcnow() >
+                REFRESH_MARGIN):
+            return
+
+        try:
+            credentials.refresh(httplib2.Http(timeout=60))
+        except (HttpAccessTokenRefreshError, httplib2.HttpLib2Error,
+                OSError) as error:
+            LOG.error('background token refresh failed: %s', error)
+
+
+PROVIDER = TokenProvider()
+
+
+def get_credentials(key_file, scopes):
+    """returns credentials for key_file from the shared PROVIDER"""
+
+    return PROVIDER.credentials(key_file, scopes)
@@ -46,7 +46,8 @@ def write_file(records: List[Tuple]) -> str:
     """Writes dict file for dumping to json
 
     Args:
-        records (List[Tuple]): generated by util.gcp.Gcp via gcp_audit
+        records (List[Tuple] or util.results.ResultsStore): generated by
+            util.gcp.Gcp via gcp_audit
 
     """
 
@@ -72,16 +73,20 @@ def write_file(records: List[Tuple]) -> str:
 
 def upload_to_bucket(records: List[Tuple],
                      keyfile: str,
-                     project: str):
+                     project: str,
+                     label: str = None):
     """Takes the file generated in _write_file and uploads it to a
     bucket for analysis.
     If the upload fails it will keep the local copy, orherwise it'll
     delete it.
 
     Args:
-        records (List[Tuple]): passed from gcp_audit
+        records (List[Tuple] or util.results.ResultsStore): passed from
+            gcp_audit
         keyfile (str): path to service file
         project (str): purely for name generation
+        label (str): what the Slack alert says was scanned, defaults
+            to project
 
     """
 
@@ -125,4 +130,5 @@ def upload_to_bucket(records: List[Tuple],
 
     # generates a specific alert in Slack
     resp['total'] = len(records)
-    notify_alerts_security(generate_upload_message(resp, project=project))
+    notify_alerts_security(generate_upload_message(resp,
+                                                   project=label or project))
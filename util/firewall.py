@@ -0,0 +1,386 @@
+"""firewall exposure analysis
+
+Source ranges are parsed with ipaddress and every rule is indexed by
+network and direction, over both CIDR space and port ranges. That lets us
+answer "which rules expose port X to the internet" with a couple of
+O(log n) lookups rather than comparing every rule with every other rule.
+"""
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+from ipaddress import ip_network
+
+LOG = logging.getLogger(__name__)
+
+# Ports we never want open to the internet
+SENSITIVE_PORTS = {
+    22: 'ssh',
+    3389: 'rdp',
+    3306: 'mysql',
+    5432: 'postgres',
+    6379: 'redis',
+    27017: 'mongodb',
+}
+
+# A public source range at least this wide counts as open to the internet,
+# so 0.0.0.0/1 style splits are caught but a single office IP isn't
+PUBLIC_PREFIXLEN = {4: 16, 6: 32}
+
+# Source ranges that aren't the internet. Includes Google's load balancer
+# health check ranges as they're allowed all over the place.
+NON_PUBLIC_NETWORKS = [ip_network(net) for net in (
+    '0.0.0.0/8',
+    '10.0.0.0/8',
+    '100.64.0.0/10',
+    '127.0.0.0/8',
+    '169.254.0.0/16',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+    '35.191.0.0/16',
+    '130.211.0.0/22',
+    '::1/128',
+    'fc00::/7',
+    'fe80::/10',
+)]
+
+PROTOCOL_NUMBERS = {'1': 'icmp', '6': 'tcp', '17': 'udp'}
+ALL_PORTS = (0, 65535)
+
+Rule = namedtuple('Rule', ['record', 'key', 'priority', 'allow', 'networks',
+                           'public', 'ports', 'targets'])
+
+
+class IntervalIndex(object):
+    """Static index over closed integer intervals.
+
+    Intervals are sorted by start and each slot also holds the largest end
+    in its implicit subtree, so overlap queries prune whole subtrees and
+    cost O(log n + k) for k results.
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[:2])
+        self._starts = [interval[0] for interval in intervals]
+        self._ends = [interval[1] for interval in intervals]
+        self._values = [interval[2] for interval in intervals]
+        self._max_end = list(self._ends)
+        self._build(0, len(intervals))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _build(self, low, high):
+        """fills in the max end of each subtree"""
+
+        if low >= high:
+            return -1
+
+        mid = (low + high) // 2
+        self._max_end[mid] = max(self._ends[mid],
+                                 self._build(low, mid),
+                                 self._build(mid + 1, high))
+        return self._max_end[mid]
+
+    def _overlapping(self, start, end):
+        """returns slots of all intervals overlapping start-end"""
+
+        found = []
+        # Nothing starting after end can overlap
+        last = bisect_right(self._starts, end)
+        stack = [(0, len(self._starts))]
+
+        while stack:
+            low, high = stack.pop()
+            if low >= high or low >= last:
+                continue
+            mid = (low + high) // 2
+            if self._max_end[mid] < start:
+                continue
+            stack.append((low, mid))
+            if mid < last:
+                if self._ends[mid] >= start:
+                    found.append(mid)
+                stack.append((mid + 1, high))
+
+        return found
+
+    def overlapping(self, start, end=None):
+        """returns values of all intervals overlapping start-end"""
+
+        end = start if end is None else end
+        return [self._values[slot] for slot in self._overlapping(start, end)]
+
+    def containing(self, start, end=None):
+        """returns values of all intervals wholly containing start-end"""
+
+        end = start if end is None else end
+        return [self._values[slot] for slot in self._overlapping(start, end)
+                if self._starts[slot] <= start and end <= self._ends[slot]]
+
+
+def _subnet_of(network, other):
+    """True if network is inside other. ipaddress only has subnet_of from
+    Python 3.7"""
+
+    return (network.version == other.version and
+            other.network_address <= network.network_address and
+            network.broadcast_address <= other.broadcast_address)
+
+
+def _is_public(network):
+    """True if network is a wide range of internet addresses"""
+
+    if network.prefixlen > PUBLIC_PREFIXLEN[network.version]:
+        return False
+
+    return not any(_subnet_of(network, private)
+                   for private in NON_PUBLIC_NETWORKS)
+
+
+def _parse_ports(ports):
+    """turns ['22', '1000-2000'] into [(22, 22), (1000, 2000)]"""
+
+    if ports == 'all' or not ports:
+        return [ALL_PORTS]
+
+    parsed = []
+    for port in ports:
+        low, _, high = str(port).partition('-')
+        parsed.append((int(low), int(high or low)))
+
+    return parsed
+
+
+def _covers(outer, inner):
+    """True if port entry outer covers port entry inner"""
+
+    protocol, low, high = inner
+    outer_protocol, outer_low, outer_high = outer
+
+    return (outer_protocol in ('all', protocol) and
+            outer_low <= low and high <= outer_high)
+
+
+def _intersects(first, second):
+    """True if port entries first and second share any traffic"""
+
+    return ('all' in (first[0], second[0]) or first[0] == second[0]) and (
+        first[1] <= second[2] and second[1] <= first[2])
+
+
+def _analysis(record):
+    """the analysis fields of a record, empty if it hasn't got any"""
+
+    return getattr(record, 'rule', None) or {}
+
+
+def parse_rule(record):
+    """parses a FirewallFull record from util.gcp into a Rule. Records
+    without analysis fields (only protocol, ports and ranges in their info)
+    are treated as ingress allow rules on a single network at the default
+    priority"""
+
+    info = record.info
+    analysis = _analysis(record)
+    allow = 'denied' not in analysis
+    entries = analysis.get('allowed') or analysis.get('denied') or [
+        {'IPProtocol': info.get('protocol'), 'ports': info.get('ports', 'all')}
+    ]
+
+    ports = []
+    for entry in entries:
+        protocol = str(entry.get('IPProtocol') or 'all').lower()
+        protocol = PROTOCOL_NUMBERS.get(protocol, protocol)
+        try:
+            ports.extend((protocol, low, high)
+                         for low, high in _parse_ports(entry.get('ports')))
+        except ValueError:
+            LOG.error('%r has invalid ports %r - ignoring them' %
+                      (record.name, entry.get('ports')))
+
+    networks = []
+    for source in info.get('ranges', []):
+        try:
+            networks.append(ip_network(source, strict=False))
+        except ValueError:
+            LOG.error('%r has invalid range %r - ignoring it' %
+                      (record.name, source))
+
+    return Rule(record=record,
+                key=(analysis.get('network', ''),
+                     analysis.get('direction', 'INGRESS')),
+                priority=int(analysis.get('priority', 1000)),
+                allow=allow,
+                networks=networks,
+                public=[net for net in networks if _is_public(net)],
+                ports=ports,
+                targets=frozenset(analysis.get('targets', [])))
+
+
+def _precedes(first, second):
+    """True if rule first is evaluated before rule second. Deny wins
+    at equal priority"""
+
+    return (first.priority < second.priority or
+            (first.priority == second.priority and
+             not first.allow and second.allow))
+
+
+def _applies_to(first, second):
+    """True if rule first applies to every instance rule second does"""
+
+    return not first.targets or (second.targets and
+                                 second.targets <= first.targets)
+
+
+def _contains(outer, inner):
+    """True if every range in inner is inside a range of outer"""
+
+    return all(any(_subnet_of(net, outer_net) for outer_net in outer)
+               for net in inner)
+
+
+class FirewallIndex(object):
+    """Indexes firewall rules for exposure, shadowing and overlap queries.
+
+    Args:
+        records (List[FirewallFull]): from Gcp.get_full_firewall_rules
+
+    """
+
+    def __init__(self, records):
+        self.rules = [parse_rule(record) for record in records
+                      if not _analysis(record).get('disabled')]
+
+        cidrs = {}
+        ports = {}
+        for rule in self.rules:
+            for net in rule.networks:
+                cidrs.setdefault(rule.key + (net.version,), []).append(
+                    (int(net.network_address), int(net.broadcast_address), rule))
+
+            # Only allows with public ranges can expose anything, but we
+            # need every deny to know what's blocked
+            if rule.allow and not rule.public:
+                continue
+            for protocol, low, high in rule.ports:
+                ports.setdefault(rule.key + (rule.allow, protocol), []).append(
+                    (low, high, rule))
+
+        self._keys = {rule.key for rule in self.rules}
+        self._cidr_index = {key: IntervalIndex(value)
+                            for key, value in cidrs.items()}
+        self._port_index = {key: IntervalIndex(value)
+                            for key, value in ports.items()}
+
+    def _port_rules(self, key, allow, protocol, port, end=None):
+        """rules on network/direction key matching protocol and covering
+        port, or every port from port to end"""
+
+        found = []
+        for proto in {protocol, 'all'}:
+            index = self._port_index.get(key + (allow, proto))
+            if index:
+                found.extend(index.containing(port, end))
+        return found
+
+    def _blocked(self, rule, protocol, port, end=None):
+        """True if a deny evaluated before rule blocks protocol/port (or
+        port to end) from all of rule's public ranges"""
+
+        return any(_precedes(deny, rule) and
+                   _applies_to(deny, rule) and
+                   _contains(deny.networks, rule.public)
+                   for deny in self._port_rules(rule.key, False,
+                                                protocol, port, end))
+
+    def exposing(self, port, protocol='tcp', network=None, direction='INGRESS'):
+        """returns records of rules exposing protocol/port to the internet
+
+        Args:
+            port (int)
+            protocol (str): tcp, udp etc
+            network (str): only check this network, as
+                projects/<p>/global/networks/<n>. Default all
+            direction (str): INGRESS or EGRESS
+
+        Returns:
+            List[FirewallFull] in the order given to the index
+
+        """
+
+        keys = [key for key in self._keys
+                if key[1] == direction and network in (None, key[0])]
+
+        exposed = [rule for key in keys
+                   for rule in self._port_rules(key, True, protocol, port)
+                   if not self._blocked(rule, protocol, port)]
+
+        return self._in_order(exposed)
+
+    def exposed_rules(self, ports=SENSITIVE_PORTS):
+        """returns records of rules exposing any of ports over tcp to the
+        internet, or exposing every protocol"""
+
+        exposed = [rule for rule in self.rules
+                   if rule.allow and rule.public and
+                   any(protocol == 'all' for protocol, _, _ in rule.ports) and
+                   not self._blocked(rule, 'all', *ALL_PORTS)]
+        for port in ports:
+            exposed.extend(self.exposing(port))
+
+        return self._in_order(exposed)
+
+    def shadowed(self):
+        """returns (record, shadowing record) pairs for rules which never
+        match because a single earlier rule covers all of their ranges,
+        ports and targets"""
+
+        shadowed = []
+        for rule in self.rules:
+            if not rule.networks:
+                continue
+            first = rule.networks[0]
+            index = self._cidr_index[rule.key + (first.version,)]
+            candidates = sorted(
+                index.containing(int(first.network_address),
+                                 int(first.broadcast_address)),
+                key=lambda other: (other.priority, other.allow))
+
+            for other in candidates:
+                if (other is not rule and
+                        _precedes(other, rule) and
+                        _applies_to(other, rule) and
+                        _contains(other.networks, rule.networks) and
+                        all(any(_covers(outer, inner) for outer in other.ports)
+                            for inner in rule.ports)):
+                    shadowed.append((rule.record, other.record))
+                    break
+
+        return shadowed
+
+    def overlapping(self, record):
+        """returns records of rules sharing any address space and ports
+        with record on the same network and direction"""
+
+        rule = parse_rule(record)
+        found = []
+        for net in rule.networks:
+            index = self._cidr_index.get(rule.key + (net.version,))
+            if index:
+                found.extend(index.overlapping(int(net.network_address),
+                                               int(net.broadcast_address)))
+
+        return self._in_order(
+            other for other in found
+            if other.record is not record and
+            any(_intersects(outer, inner)
+                for outer in other.ports for inner in rule.ports)
+        )
+
+    def _in_order(self, rules):
+        """dedupes rules (or records) and returns records in index order"""
+
+        records = {id(getattr(rule, 'record', rule)) for rule in rules}
+        return [rule.record for rule in self.rules
+                if id(rule.record) in records]
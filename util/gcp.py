@@ -3,18 +3,77 @@
 import socket
 import os
 import logging
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import yaml
 import time
-from random import randint
+from random import randint, sample
 
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 
 from .generate import generate_session
+from .planner import INLINE, BATCH, SAMPLE, SKIP, BATCH_SIZE, SAMPLE_SIZE
 
 LOG = logging.getLogger(__name__)
 
-AllTuple = namedtuple('AllTuple', ['name', 'type_', 'info'])
+# Storage has its own batch endpoint, the global one is gone
+BATCH_URI = 'https://storage.googleapis.com/batch/storage/v1'
+
+AllTuple = namedtuple('AllTuple', ['name', 'type_', 'info', 'project'])
+FirewallFull = namedtuple('FirewallFull', ['info', 'name', 'type_', 'rule',
+                                           'project'])
+
+
+def _transient(error):
+    """True for errors worth retrying - timeouts, rate limiting and server
+    errors. Others, like 403 or 404, will fail the same way again"""
+
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, socket.timeout)
+
+
+def _network_path(network):
+    """cuts a network URL down to projects/<p>/global/networks/<n>. The
+    project has to stay in, every project has a network called default"""
+
+    start = network.find('projects/')
+    return network[start:] if start >= 0 else network
+
+
+def firewall_record(rule, project=''):
+    """builds a FirewallFull record from a compute firewall resource.
+    info holds what gets reported: protocol and ports from the first
+    allowed (or denied) entry, and the source ranges. Everything
+    util.firewall needs for analysis goes in rule"""
+
+    action = 'allowed' if 'allowed' in rule else 'denied'
+    entries = [{'IPProtocol': entry.get('IPProtocol', entry.get('ipProtocol')),
+                # If they're open to everyone this will be empty
+                'ports': entry.get('ports', 'all')}
+               for entry in rule.get(action, [])]
+    first = entries[0] if entries else {'IPProtocol': None, 'ports': 'all'}
+
+    info = {'protocol': first['IPProtocol'],
+            'ranges': rule.get('sourceRanges', []),
+            'ports': first['ports']
+           }
+
+    analysis = {action: entries,
+                'network': _network_path(rule.get('network', '')),
+                'direction': rule.get('direction', 'INGRESS'),
+                'priority': rule.get('priority', 1000),
+                'targets': (rule.get('targetTags', []) +
+                            rule.get('targetServiceAccounts', [])),
+                'disabled': rule.get('disabled', False)
+               }
+
+    return FirewallFull(name=rule['name'],
+                        info=info,
+                        type_=rule.get('kind', 'compute#firewall'),
+                        rule=analysis,
+                        project=project)
+
 
 class Gcp(object):
     """Generates returners for buckets and firewalls. Unfortunately
@@ -32,6 +91,8 @@ class Gcp(object):
                                'objects': False}
         self.whitelist = self._load_whitelist_file(whitelist) if whitelist else None
         self.buckets = self._get_all_buckets()
+        # Set to a util.planner.ScanPlan to pick a strategy per bucket
+        self.plan = None
 
     def _load_whitelist_file(self, whitelist):
         """loads config file in ./gcp-audit/config"""
@@ -89,8 +150,29 @@ class Gcp(object):
         return buckets
 
 
+    def _list_objects(self, bucket, page_token=None):
+        """lists one page of objects in bucket, None if it keeps failing"""
+
+        for i in range(5):
+            try:
+                return self.storage_session.objects().list(
+                    bucket=bucket, pageToken=page_token).execute()
+            except (socket.timeout, HttpError) as error:
+                if not _transient(error):
+                    LOG.error('listing %r failed: %s', bucket, error)
+                    return None
+                i += 1
+                LOG.error('listing %r failed, retry number %r: %s',
+                          bucket, i, error)
+                if i < 5:
+                    time.sleep(i + randint(0, 100) / 1000)
+
+        return None
+
     def _get_all_objects(self):
-        """gets all objects from each bucket in a damn inefficient way"""
+        """gets all objects from each bucket, page by page. The first page
+        is taken from self.plan if it was listed while planning, and only
+        that page is used for buckets which are sampled"""
 
         objects = namedtuple('AllObjects', ['bucket', 'name'])
         all_objects_list = []
@@ -100,28 +182,25 @@ class Gcp(object):
             object_whitelist = self.whitelist['objects']
 
         for bucket in self.buckets:
-            for i in range(5):
-                try:
-                    all_objects = self.storage_session.objects().list(
-                        bucket=bucket).execute()
-                    all_objects = all_objects['items']
-                except KeyError:
-                    # Bucket is empty so we'll skip
-                    continue
-                except (socket.timeout, HttpError) as error:
-                    LOG.error(error, 'retry number %r' % i)
-                    if i < 5:
-                        time.sleep(i + randint(0, 100) / 1000)
-                    else:
-                      time.sleep(i/i + randint(0, 100) / 1000)
-                        
-                else:
-                    for obj in all_objects:
-                        if obj not in object_whitelist:
-                            all_objects_list.append(
-                                objects(bucket=obj['bucket'], name=obj['name'])
-                                )
-                break
+            strategy = self.plan.strategy(bucket) if self.plan else INLINE
+            if strategy == SKIP:
+                continue
+
+            page = self.plan.take_page(bucket) if self.plan else None
+            if page is None:
+                page = self._list_objects(bucket)
+
+            while page is not None:
+                for obj in page.get('items', []):
+                    if obj not in object_whitelist:
+                        all_objects_list.append(
+                            objects(bucket=obj['bucket'], name=obj['name'])
+                            )
+
+                page_token = page.get('nextPageToken')
+                if not page_token or strategy == SAMPLE:
+                    break
+                page = self._list_objects(bucket, page_token)
 
         return all_objects_list
 
@@ -132,6 +211,9 @@ class Gcp(object):
         bucket_acl_list = []
 
         for bucket in self.buckets:
+            if self.plan and self.plan.uniform(bucket):
+                # ACLs are disabled with uniform bucket-level access
+                continue
             for i in range(5):
                 try:
                     bucket_session = self.storage_session.bucketAccessControls
@@ -151,7 +233,8 @@ class Gcp(object):
                         }
                         acl_tuple = AllTuple(name=item['bucket'],
                                              type_='Bucket',
-                                             info=info
+                                             info=info,
+                                             project=self.project
                                             )
                         bucket_acl_list.append(acl_tuple)
                 break
@@ -159,45 +242,120 @@ class Gcp(object):
         LOG.info('processing %r buckets' % len(bucket_acl_list))
         return bucket_acl_list
 
-    def get_all_objects_acls(self):
-        """gets access control lists for all bucket objects and appends them
-        to a list"""
+    def _object_acl_tuples(self, object_acl):
+        """turns an objectAccessControls list response into AllTuples"""
+
+        acl_tuples = []
+
+        for obj_acl in object_acl.get('items', []):
+            info = {
+                'bucket': obj_acl['bucket'],
+                'entity': obj_acl['entity'],
+                'role': obj_acl['role'],
+                'id': obj_acl['id']
+            }
+
+            acl_tuples.append(AllTuple(
+                name=obj_acl['object'],
+                type_='Bucket Object',
+                info=info,
+                project=self.project
+            ))
+
+        return acl_tuples
+
+    def _get_objects_acls_inline(self, objects):
+        """gets access control lists one object at a time, retrying each
+        object a few times if the error is transient"""
 
         all_acls = []
 
-        for i in range(5):
-            for obj in self._get_all_objects():
+        for obj in objects:
+            for i in range(5):
                 try:
-                    bucket = obj.bucket
-                    object_name = obj.name
                     object_acl = self.storage_session.objectAccessControls(
-                        ).list(bucket=bucket,
-                               object=object_name).execute()
+                        ).list(bucket=obj.bucket,
+                               object=obj.name).execute()
                 except (socket.timeout, HttpError) as error:
+                    if not _transient(error):
+                        LOG.error('acl request for %r failed: %s',
+                                  obj.name, error)
+                        break
                     i += 1
+                    LOG.error('acl request for %r failed, retry number %r: %s',
+                              obj.name, i, error)
                     if i < 5:
                         time.sleep(i + randint(0, 100) / 1000)
-                    else:
-                      time.sleep(i/i + randint(0, 100) / 1000)
-                    LOG.error(error, 'retry number %r' % i)
                 else:
-                    object_acl = object_acl['items']
+                    all_acls.extend(self._object_acl_tuples(object_acl))
+                    break
 
-                    for obj_acl in object_acl:
-                        info = {
-                            'bucket': obj_acl['bucket'],
-                            'entity': obj_acl['entity'],
-                            'id': obj_acl['id']
-                        }
+        return all_acls
 
-                        acl_tuple = AllTuple(
-                            name=obj_acl['object'],
-                            type_='Bucket Object',
-                            info=info
-                        )
+    def _get_objects_acls_batched(self, objects):
+        """gets access control lists in batches of BATCH_SIZE objects.
+        Objects whose request fails with a transient error, or whose whole
+        batch fails, are retried one at a time"""
 
-                        all_acls.append(acl_tuple)
-            break
+        all_acls = []
+        failed = []
+
+        for start in range(0, len(objects), BATCH_SIZE):
+            chunk = objects[start:start + BATCH_SIZE]
+            answered = set()
+
+            def callback(request_id, response, exception, chunk=chunk,
+                         answered=answered):
+                answered.add(request_id)
+                if exception is not None:
+                    LOG.error('batched acl request %r failed: %s',
+                              request_id, exception)
+                    if _transient(exception):
+                        failed.append(chunk[int(request_id)])
+                else:
+                    all_acls.extend(self._object_acl_tuples(response))
+
+            batch = BatchHttpRequest(callback=callback, batch_uri=BATCH_URI)
+            for index, obj in enumerate(chunk):
+                batch.add(self.storage_session.objectAccessControls(
+                    ).list(bucket=obj.bucket, object=obj.name),
+                          request_id=str(index))
+            try:
+                batch.execute()
+            except (socket.timeout, HttpError) as error:
+                LOG.error('batch of %r objects failed: %s', len(chunk), error)
+                failed.extend(obj for index, obj in enumerate(chunk)
+                              if str(index) not in answered)
+
+        if failed:
+            LOG.info('retrying %r objects one at a time' % len(failed))
+            all_acls.extend(self._get_objects_acls_inline(failed))
+
+        return all_acls
+
+    def get_all_objects_acls(self):
+        """gets access control lists for all bucket objects and appends them
+        to a list. Each bucket's objects are fetched with the strategy from
+        self.plan (see util.planner), or one at a time without a plan"""
+
+        all_acls = []
+        buckets = OrderedDict()
+
+        for obj in self._get_all_objects():
+            buckets.setdefault(obj.bucket, []).append(obj)
+
+        for bucket, objects in buckets.items():
+            strategy = self.plan.strategy(bucket) if self.plan else INLINE
+
+            if strategy == SAMPLE and len(objects) > SAMPLE_SIZE:
+                LOG.info('sampling %r of %r objects in %r' %
+                         (SAMPLE_SIZE, len(objects), bucket))
+                objects = sample(objects, SAMPLE_SIZE)
+
+            if strategy in (BATCH, SAMPLE):
+                all_acls.extend(self._get_objects_acls_batched(objects))
+            else:
+                all_acls.extend(self._get_objects_acls_inline(objects))
 
         LOG.info('processing %r objects' % len(all_acls))
         return all_acls
@@ -230,9 +388,6 @@ class Gcp(object):
         """gets full firewall rules"""
 
         firewall_full_list = []
-        firewall_full = namedtuple('FirewallFull', ['info',
-                                                    'name',
-                                                    'type_'])
 
         for i in range(5):
             for firewall in self._get_all_firewall_rules():
@@ -241,27 +396,13 @@ class Gcp(object):
                     all_rules = all_rules(
                         ).get(firewall=firewall.name,
                               project=self.project).execute()
-                    protocol = all_rules['allowed'][0]
-                    ports = protocol['ports']
-                     # If they're open to everyone this will be empty
-                except KeyError:
-                    ports = 'all'
-                    continue
                 except (socket.timeout, HttpError) as error:
                     i += 1
                     LOG.error(error, 'retry number %r' % i)
                     time.sleep(i + randint(0, 100) / 1000)
                 else:
-                    info = {'protocol': protocol['IPProtocol'],
-                            'ranges': all_rules['sourceRanges'],
-                            'ports': ports
-                           }
-
-                    firewall_full_list.append(
-                        firewall_full(name=all_rules['name'],
-                                      info=info,
-                                      type_=all_rules['kind'])
-                    )
+                    firewall_full_list.append(firewall_record(all_rules,
+                                                             self.project))
             break
 
         LOG.info('processing %r rules' % len(firewall_full_list))
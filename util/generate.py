@@ -4,22 +4,30 @@ import logging
 from typing import Tuple, List
 
 from googleapiclient import discovery
-from oauth2client.service_account import ServiceAccountCredentials
+
+from .credentials import get_credentials
+from .results import ResultsStore
+from .transport import FieldMaskRequest, shared_http
 
 LOG = logging.getLogger(__name__)
 
+# Covers both storage and compute so one token serves every session
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
 
 def generate_session(key_file='', service='compute'):
-    """generates GCP session from keyfile"""
+    """generates GCP session from keyfile. Sessions share cached
+    credentials (see util.credentials) and a pooled, gzip-negotiating
+    transport (see util.transport)"""
 
     session = None
 
     if key_file:
         try:
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(
-                key_file
-            )
-            session = discovery.build(service, 'v1', credentials=credentials)
+            credentials = get_credentials(key_file, SCOPES)
+            session = discovery.build(service, 'v1',
+                                      http=shared_http(credentials),
+                                      requestBuilder=FieldMaskRequest)
         except FileNotFoundError as error:
             LOG.error(error)
 
@@ -31,7 +39,7 @@ def generate_message(items: List[Tuple],
     """generates a message with the payload from gcp_audit
 
     Args:
-        items (List[namedtuple])
+        items (List[namedtuple] or util.results.ResultsStore)
 
     Returns:
        Str for processing in Slack
@@ -65,7 +73,7 @@ def generate_dict_message(items: List[Tuple]) -> dict:
     """generates json for writing to file if violations exceed set limit
 
     Args:
-        items (List[Tuple])
+        items (List[Tuple] or util.results.ResultsStore)
 
     Returns:
         json formatted dict
@@ -74,7 +82,7 @@ def generate_dict_message(items: List[Tuple]) -> dict:
 
     result_list = []
 
-    if isinstance(items, list):
+    if isinstance(items, (list, ResultsStore)):
         for item in items:
             result = {}
             result[item.type_] = {
@@ -83,10 +91,40 @@ def generate_dict_message(items: List[Tuple]) -> dict:
                 }
             result_list.append(result)
     else:
-        raise TypeError('items must be a list of tuples')
+        raise TypeError('items must be a list of tuples or a ResultsStore')
 
     return result_list
 
+def generate_summary_message(store,
+                             project: str,
+                             top: int = 5) -> str:
+    """generates a summary of violations for Slack, for when there are
+    too many to list individually
+
+    Args:
+        store (util.results.ResultsStore)
+        top (int): how many buckets and entities to list
+
+    Returns:
+        str
+    """
+
+    base_msg = f"Summary of {len(store)} violations in *{project}*:\n"
+
+    sections = []
+    for title, column in [('Project', 'project'),
+                          ('Type', 'type_'),
+                          ('Bucket', 'bucket'),
+                          ('Entity', 'entity')]:
+        counts = store.count_by(column)
+        counts.pop('', None)
+        info = ["`%s`: %s" % (value, count)
+                for value, count in counts.most_common(top)]
+        if info:
+            sections.append("*%s*: %s\n" % (title, ', '.join(info)))
+
+    return base_msg + ''.join(sections)
+
 def generate_upload_message(resp: dict,
                             project: str):
     """Generates message for when violation results are too large
@@ -0,0 +1,257 @@
+"""plans a scan before running it
+
+A few cheap calls (one bucket listing, the first page of objects in each
+bucket and the firewall listing) are enough to estimate how many API calls,
+how long and how much memory the full scan will take. From the same sample
+each bucket gets a strategy for its object ACLs. Sampling huge buckets
+rather than checking every object is opt in, as it leaves objects
+unchecked. The first pages are kept so the scan doesn't list them again.
+"""
+import logging
+import math
+import socket
+from collections import namedtuple
+
+from googleapiclient.errors import HttpError
+
+LOG = logging.getLogger(__name__)
+
+# Object ACL strategies
+INLINE = 'inline'
+BATCH = 'batch'
+SAMPLE = 'sample'
+SKIP = 'skip'
+
+PAGE_SIZE = 1000
+INLINE_MAX = 50
+BATCH_SIZE = 100
+SAMPLE_SIZE = 100
+
+# Rough costs used for the estimates
+REQUEST_SECONDS = 0.15
+OBJECT_BYTES = 400
+ACL_BYTES = 800
+ACLS_PER_OBJECT = 4
+
+BUCKET_FIELDS = ('items(name,iamConfiguration/uniformBucketLevelAccess/enabled),'
+                 'nextPageToken')
+
+BucketPlan = namedtuple('BucketPlan', ['bucket', 'objects', 'more', 'uniform',
+                                       'strategy', 'checked', 'api_calls',
+                                       'requests'])
+
+
+def _strategy(objects, more, uniform, sample=False):
+    """picks the object ACL strategy for a bucket. objects is None if the
+    bucket couldn't be sampled, those are checked inline as before"""
+
+    if objects is None:
+        return INLINE
+    if uniform or not objects:
+        # ACLs don't apply with uniform bucket-level access
+        return SKIP
+    if more and sample:
+        return SAMPLE
+    if objects > INLINE_MAX:
+        return BATCH
+    return INLINE
+
+
+def _bucket_plan(bucket, objects, more, uniform, sample=False):
+    """works out strategy and cost for a bucket. Buckets with more than a
+    page of objects are only costed for the first page unless sampled"""
+
+    strategy = _strategy(objects, more, uniform, sample)
+    if strategy == SAMPLE:
+        checked = min(objects, SAMPLE_SIZE)
+    elif strategy == SKIP or objects is None:
+        checked = 0
+    else:
+        checked = objects
+
+    # bucket ACLs, then listing objects
+    api_calls = int(not uniform) + int(strategy != SKIP) + checked
+    requests = api_calls
+    if strategy in (BATCH, SAMPLE):
+        requests += math.ceil(checked / BATCH_SIZE) - checked
+
+    return BucketPlan(bucket=bucket,
+                      objects=objects,
+                      more=more,
+                      uniform=uniform,
+                      strategy=strategy,
+                      checked=checked,
+                      api_calls=api_calls,
+                      requests=requests)
+
+
+class ScanPlan(object):
+    """Strategy per bucket plus estimates for the whole scan.
+
+    Args:
+        buckets (List[BucketPlan])
+        firewalls (int): number of firewall rules
+        pages (dict): first page of objects listed for each bucket
+
+    """
+
+    def __init__(self, buckets, firewalls=0, pages=None):
+        self.buckets = {plan.bucket: plan for plan in buckets}
+        self.firewalls = firewalls
+        self.pages = pages or {}
+
+    def strategy(self, bucket):
+        """object ACL strategy for bucket, inline if it wasn't planned"""
+
+        plan = self.buckets.get(bucket)
+        return plan.strategy if plan else INLINE
+
+    def uniform(self, bucket):
+        """True if bucket has uniform bucket-level access"""
+
+        plan = self.buckets.get(bucket)
+        return bool(plan and plan.uniform)
+
+    def take_page(self, bucket):
+        """hands over the first page of objects listed for bucket, or None.
+        Each page is only handed over once so it can be freed"""
+
+        return self.pages.pop(bucket, None)
+
+    @property
+    def sampled(self):
+        """buckets where only a sample of objects is checked"""
+
+        return [plan.bucket for plan in self.buckets.values()
+                if plan.strategy == SAMPLE]
+
+    @property
+    def api_calls(self):
+        """estimated calls against quota, including the listings"""
+
+        return (2 + self.firewalls +
+                sum(plan.api_calls for plan in self.buckets.values()))
+
+    @property
+    def requests(self):
+        """estimated HTTP round trips - batches count once"""
+
+        return (2 + self.firewalls +
+                sum(plan.requests for plan in self.buckets.values()))
+
+    @property
+    def seconds(self):
+        """estimated wall time"""
+
+        return self.requests * REQUEST_SECONDS
+
+    @property
+    def memory(self):
+        """estimated peak bytes held in records"""
+
+        objects = sum(plan.objects or 0 for plan in self.buckets.values()
+                      if plan.strategy != SKIP)
+        checked = sum(plan.checked for plan in self.buckets.values())
+        return objects * OBJECT_BYTES + checked * ACLS_PER_OBJECT * ACL_BYTES
+
+    def format(self):
+        """human readable plan for --plan"""
+
+        lines = ['%-40s %10s %9s %9s' % ('bucket', 'objects', 'strategy',
+                                         'calls')]
+        for plan in self.buckets.values():
+            if plan.objects is None:
+                objects = 'unknown'
+            else:
+                objects = '%s%s' % (plan.objects, '+' if plan.more else '')
+            lines.append('%-40s %10s %9s %9s' % (plan.bucket, objects,
+                                                 plan.strategy, plan.api_calls))
+
+        lines.extend([
+            '',
+            'sampled buckets: %s' % (', '.join(self.sampled) or 'none'),
+            'firewall rules: %s' % self.firewalls,
+            'api calls: %s' % self.api_calls,
+            'http requests: %s' % self.requests,
+            'wall time: ~%ds' % math.ceil(self.seconds),
+            'memory: ~%.1f MB' % (self.memory / 1e6),
+        ])
+        return '\n'.join(lines)
+
+
+def _uniform_buckets(gcp):
+    """names of buckets with uniform bucket-level access"""
+
+    try:
+        all_buckets = gcp.storage_session.buckets().list(
+            project=gcp.project, fields=BUCKET_FIELDS).execute()
+    except (socket.timeout, HttpError) as error:
+        LOG.error('could not check uniform bucket-level access: %s', error)
+        return set()
+
+    return {bucket['name'] for bucket in all_buckets.get('items', [])
+            if bucket.get('iamConfiguration', {}).get(
+                'uniformBucketLevelAccess', {}).get('enabled')}
+
+
+def _first_page(gcp, bucket):
+    """returns the first page of objects in bucket, or None if the bucket
+    couldn't be listed"""
+
+    try:
+        return gcp.storage_session.objects().list(
+            bucket=bucket, maxResults=PAGE_SIZE).execute()
+    except (socket.timeout, HttpError) as error:
+        LOG.error('could not sample %r: %s', bucket, error)
+        return None
+
+
+def _count_firewalls(gcp):
+    """number of firewall rules in the project"""
+
+    try:
+        all_rules = gcp.compute_session.firewalls().list(
+            project=gcp.project).execute()
+    except (socket.timeout, HttpError) as error:
+        LOG.error('could not count firewall rules: %s', error)
+        return 0
+
+    return len(all_rules.get('items', []))
+
+
+def plan_scan(gcp, sample=False):
+    """samples the project behind gcp and plans the scan
+
+    Args:
+        gcp (util.gcp.Gcp)
+        sample (bool): only check a sample of objects in buckets with more
+            than a page of them
+
+    Returns:
+        ScanPlan
+
+    """
+
+    buckets = []
+    pages = {}
+    if gcp.storage_session:
+        uniform = _uniform_buckets(gcp)
+        for bucket in gcp.buckets:
+            if bucket in uniform:
+                objects, more = 0, False
+            else:
+                page = _first_page(gcp, bucket)
+                if page is None:
+                    objects, more = None, False
+                else:
+                    pages[bucket] = page
+                    objects = len(page.get('items', []))
+                    more = 'nextPageToken' in page
+            buckets.append(_bucket_plan(bucket, objects, more,
+                                        bucket in uniform, sample))
+
+    firewalls = _count_firewalls(gcp) if gcp.compute_session else 0
+
+    plan = ScanPlan(buckets, firewalls, pages)
+    LOG.info('planned %r api calls, ~%ds' % (plan.api_calls, plan.seconds))
+    return plan
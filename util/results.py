@@ -0,0 +1,209 @@
+"""columnar store for violation records
+
+Each column is dictionary encoded, so a row is a handful of small integer
+codes in array-backed columns rather than a namedtuple with a nested dict.
+Group-by counts run over the integer columns and the whole store can be
+saved to (and loaded from) a compact gzipped file.
+
+Iterating over a store gives back a record per row, so it can be passed
+anywhere a list of records from util.gcp.Gcp was. ACL ids aren't kept.
+"""
+import gzip
+import json
+import sys
+from array import array
+from collections import Counter, namedtuple
+from typing import List, Tuple
+
+COLUMNS = ('project', 'type_', 'name', 'bucket', 'entity', 'role', 'detail')
+
+# info keys with a column of their own, ids are dropped
+INFO_COLUMNS = ('bucket', 'entity', 'role', 'id')
+
+Row = namedtuple('Row', ['name', 'type_', 'info', 'project'])
+
+MAGIC = b'GCPAUDIT-RESULTS-1\n'
+
+
+class ResultsStoreError(Exception):
+    """Custom exception for unreadable results files"""
+    pass
+
+
+def _typecode(size: int) -> str:
+    """narrowest array typecode able to hold size codes"""
+
+    for code in ('B', 'H', 'I'):
+        if size <= 2 ** (8 * array(code).itemsize):
+            return code
+    return 'L'
+
+
+class ResultsStore(object):
+    """Dictionary encoded, column oriented store of violations.
+
+    Args:
+        records (List[Tuple]): optional records generated by util.gcp.Gcp
+        project (str): project the records came from, if they don't say
+
+    """
+
+    def __init__(self,
+                 records: List[Tuple] = None,
+                 project: str = ''):
+        self._values = {column: [] for column in COLUMNS}
+        self._codes = {column: {} for column in COLUMNS}
+        self._columns = {column: array('I') for column in COLUMNS}
+
+        for record in records or []:
+            self.append(record, project)
+
+    def __len__(self):
+        return len(self._columns['project'])
+
+    def __iter__(self):
+        columns = [self._columns[column] for column in COLUMNS]
+        values = [self._values[column] for column in COLUMNS]
+
+        for codes in zip(*columns):
+            (project, type_, name, bucket,
+             entity, role, detail) = (value[code] for value, code
+                                      in zip(values, codes))
+            info = json.loads(detail) if detail else {}
+            if bucket and type_ != 'Bucket':
+                info['bucket'] = bucket
+            if entity:
+                info['entity'] = entity
+            if role:
+                info['role'] = role
+            yield Row(name=name, type_=type_, info=info, project=project)
+
+    def _encode(self, column: str, value: str) -> int:
+        """returns the code for value, adding it to the dictionary if new"""
+
+        codes = self._codes[column]
+        try:
+            return codes[value]
+        except KeyError:
+            codes[value] = len(self._values[column])
+            self._values[column].append(value)
+            return codes[value]
+
+    def append(self, record: Tuple, project: str = ''):
+        """adds a single record from util.gcp.Gcp. The record's own
+        project is used if it has one"""
+
+        info = record.info
+        project = getattr(record, 'project', '') or project or ''
+        detail = {key: value for key, value in info.items()
+                  if key not in INFO_COLUMNS}
+        if record.type_ == 'Bucket':
+            bucket = record.name
+        else:
+            bucket = info.get('bucket', '')
+
+        row = {
+            'project': project,
+            'type_': record.type_,
+            'name': record.name,
+            'bucket': bucket,
+            'entity': info.get('entity', ''),
+            'role': info.get('role', ''),
+            'detail': json.dumps(detail, sort_keys=True) if detail else ''
+        }
+
+        for column in COLUMNS:
+            self._columns[column].append(self._encode(column, str(row[column])))
+
+    def extend(self, records: List[Tuple], project: str = ''):
+        """adds records from util.gcp.Gcp"""
+
+        for record in records:
+            self.append(record, project)
+
+    def values(self, column: str) -> List[str]:
+        """returns the decoded values of column, one per row"""
+
+        values = self._values[column]
+        return [values[code] for code in self._columns[column]]
+
+    def count_by(self, *columns: str) -> Counter:
+        """counts rows per distinct value of one or more columns
+
+        Args:
+            columns (str): any of COLUMNS
+
+        Returns:
+            Counter keyed by value, or by a tuple of values when grouping
+            by more than one column
+
+        """
+
+        if len(columns) == 1:
+            values = self._values[columns[0]]
+            counts = Counter(self._columns[columns[0]])
+            return Counter({values[code]: count
+                            for code, count in counts.items()})
+
+        counts = Counter(zip(*(self._columns[column] for column in columns)))
+        return Counter({
+            tuple(self._values[column][code]
+                  for column, code in zip(columns, key)): count
+            for key, count in counts.items()
+        })
+
+    def save(self, path: str):
+        """writes the store to path. Each column is written with the
+        narrowest integer type its dictionary allows"""
+
+        header = {'rows': len(self),
+                  'byteorder': sys.byteorder,
+                  'columns': []}
+        data = []
+
+        for column in COLUMNS:
+            codes = array(_typecode(len(self._values[column])),
+                          self._columns[column])
+            header['columns'].append({'name': column,
+                                      'typecode': codes.typecode,
+                                      'values': self._values[column]})
+            data.append(codes.tobytes())
+
+        with gzip.open(path, 'wb') as results_file:
+            results_file.write(MAGIC)
+            results_file.write(json.dumps(header).encode('utf-8') + b'\n')
+            for chunk in data:
+                results_file.write(chunk)
+
+    @classmethod
+    def load(cls, path: str) -> 'ResultsStore':
+        """reads a store written by save"""
+
+        store = cls()
+
+        with gzip.open(path, 'rb') as results_file:
+            if results_file.readline() != MAGIC:
+                raise ResultsStoreError('%s is not a results file' % path)
+            header = json.loads(results_file.readline().decode('utf-8'))
+
+            for name in COLUMNS:
+                store._values[name] = ['']
+                store._codes[name] = {'': 0}
+                store._columns[name] = array('I', [0] * header['rows'])
+
+            for column in header['columns']:
+                codes = array(column['typecode'])
+                chunk = results_file.read(codes.itemsize * header['rows'])
+                if len(chunk) != codes.itemsize * header['rows']:
+                    raise ResultsStoreError('%s is truncated' % path)
+                codes.frombytes(chunk)
+                if header['byteorder'] != sys.byteorder:
+                    codes.byteswap()
+
+                name = column['name']
+                store._values[name] = column['values']
+                store._codes[name] = {value: code for code, value
+                                      in enumerate(column['values'])}
+                store._columns[name] = array('I', codes)
+
+        return store
@@ -0,0 +1,78 @@
+"""shared HTTP transport for the storage and compute sessions
+
+Every session built in a thread shares one authorised httplib2.Http, so
+connections to the Google APIs are kept alive and reused across services.
+Requests go through FieldMaskRequest, which adds a partial-response field
+mask to each API method Gcp calls, so we only pull back (and parse) the
+fields we actually use.
+"""
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httplib2
+from googleapiclient.http import HttpRequest
+
+DEFAULT_TIMEOUT = 60
+
+# Fields used per API method - keep these in step with util.gcp
+FIELD_MASKS = {
+    'storage.buckets.list': 'items(name),nextPageToken',
+    'storage.objects.list': 'items(bucket,name),nextPageToken',
+    'storage.bucketAccessControls.list': 'items(id,bucket,entity,role)',
+    'storage.objectAccessControls.list':
+        'items(id,bucket,object,entity,role)',
+    'storage.objects.insert': 'bucket,id,name,size,timeCreated',
+    'compute.firewalls.list': 'items(name),nextPageToken',
+    'compute.firewalls.get': ('name,kind,network,direction,priority,allowed,'
+                              'denied,sourceRanges,targetTags,'
+                              'targetServiceAccounts,disabled'),
+}
+
+_LOCAL = threading.local()
+
+
+def _with_fields(uri, fields):
+    """adds fields to the query string of uri unless already there"""
+
+    parts = urlsplit(uri)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if any(key == 'fields' for key, _ in query):
+        return uri
+
+    query.append(('fields', fields))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class FieldMaskRequest(HttpRequest):
+    """HttpRequest which applies the FIELD_MASKS entry for its method.
+    Pass as requestBuilder to discovery.build."""
+
+    def __init__(self, http, postproc, uri, method='GET', body=None,
+                 headers=None, methodId=None, resumable=None):
+        # pylint: disable=too-many-arguments,invalid-name
+        if methodId in FIELD_MASKS:
+            uri = _with_fields(uri, FIELD_MASKS[methodId])
+
+        super().__init__(http, postproc, uri, method=method, body=body,
+                         headers=headers, methodId=methodId,
+                         resumable=resumable)
+
+
+def shared_http(credentials):
+    """returns this thread's authorised Http for credentials, creating it
+    on first use. httplib2 isn't thread safe so each thread gets its own.
+
+    Args:
+        credentials: oauth2client credentials, already scoped
+
+    """
+
+    pool = getattr(_LOCAL, 'pool', None)
+    if pool is None:
+        pool = _LOCAL.pool = {}
+
+    key = getattr(credentials, 'service_account_email', None) or id(credentials)
+    if key not in pool:
+        pool[key] = credentials.authorize(httplib2.Http(timeout=DEFAULT_TIMEOUT))
+
+    return pool[key]